@@ -1,75 +1,165 @@
 import sqlite3
-import json
+import orjson
+import threading
+import zstandard as zstd
 
 # Database setup
 DB_PATH = "podcast_data.db"
 
+# Single long-lived connection shared by all requests (guarded by _lock)
+_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+_lock = threading.Lock()
+
+# Transcripts are stored as zstd-compressed UTF-8; only use these under _lock
+_CCTX = zstd.ZstdCompressor(level=6)
+_DCTX = zstd.ZstdDecompressor()
+
+# Schema version tracked in PRAGMA user_version; 1 = transcripts compressed
+_SCHEMA_VERSION = 1
+
+# Fixed SQL used by the helpers below, kept in one place for readability
+_INSERT_SQL = """
+    INSERT INTO podcast_data (transcript, summary, takeaways, quiz)
+    VALUES (?, ?, ?, ?)
+"""
+_SELECT_LATEST_SQL = "SELECT summary, takeaways FROM podcast_data WHERE id = (SELECT MAX(id) FROM podcast_data)"
+_SELECT_ALL_SQL = "SELECT id, summary, takeaways FROM podcast_data ORDER BY id DESC"
+_SELECT_BY_ID_SQL = "SELECT summary, takeaways FROM podcast_data WHERE id = ?"
+_SELECT_TRANSCRIPT_SQL = "SELECT transcript FROM podcast_data WHERE id = ?"
+_SELECT_TEXT_TRANSCRIPTS_SQL = "SELECT id, transcript FROM podcast_data WHERE typeof(transcript) = 'text'"
+_UPDATE_TRANSCRIPT_SQL = "UPDATE podcast_data SET transcript = ? WHERE id = ?"
+_SELECT_LLM_CACHE_SQL = "SELECT payload FROM llm_cache WHERE hash = ? AND kind = ?"
+_INSERT_LLM_CACHE_SQL = "INSERT OR REPLACE INTO llm_cache (hash, kind, payload) VALUES (?, ?, ?)"
+
 def init_db():
     """Initializes the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS podcast_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            transcript TEXT,
-            summary TEXT,
-            takeaways TEXT,  -- Stored as JSON
-            quiz TEXT        -- Stored as JSON
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with _lock:
+        cursor = _conn.cursor()
+        # WAL lets readers run alongside the writer; NORMAL sync avoids an fsync per INSERT
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS podcast_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transcript BLOB,  -- zstd-compressed UTF-8
+                summary TEXT,
+                takeaways TEXT,  -- Stored as JSON
+                quiz TEXT        -- Stored as JSON
+            )
+        """)
+        # Entries are never evicted; rows for old prompt versions or models
+        # can be removed with DELETE FROM llm_cache WHERE kind = ...
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                hash TEXT,        -- SHA-256 of the transcript
+                kind TEXT,        -- e.g. summary:v2:<model id>
+                payload TEXT,     -- Stored as JSON
+                PRIMARY KEY (hash, kind)
+            )
+        """)
+
+        # Compress transcripts stored as plain text by older versions (once per database)
+        if cursor.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            rows = cursor.execute(_SELECT_TEXT_TRANSCRIPTS_SQL).fetchall()
+            cursor.execute("BEGIN")
+            cursor.executemany(_UPDATE_TRANSCRIPT_SQL, [
+                (_CCTX.compress(transcript.encode()), podcast_id) for podcast_id, transcript in rows
+            ])
+            cursor.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            cursor.execute("COMMIT")
+
+def close_db():
+    """Closes the shared database connection."""
+    with _lock:
+        _conn.close()
 
 def save_podcast_data(transcript: str, summary: str, takeaways: list, quiz: dict):
     """Saves podcast transcript, summary, key takeaways, and quiz into the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO podcast_data (transcript, summary, takeaways, quiz)
-        VALUES (?, ?, ?, ?)
-    """, (transcript, summary, json.dumps(takeaways), json.dumps(quiz)))
-    
-    conn.commit()
-    conn.close()
+    with _lock:
+        _conn.execute(_INSERT_SQL, (_CCTX.compress(transcript.encode()), summary, orjson.dumps(takeaways).decode(), orjson.dumps(quiz).decode()))
+
+def save_podcast_data_many(rows):
+    """Saves many (transcript, summary, takeaways, quiz) rows in a single transaction."""
+    with _lock:
+        params = [
+            (_CCTX.compress(transcript.encode()), summary, orjson.dumps(takeaways).decode(), orjson.dumps(quiz).decode())
+            for transcript, summary, takeaways, quiz in rows
+        ]
+        # The connection is in autocommit mode, so open the transaction explicitly
+        _conn.execute("BEGIN")
+        try:
+            _conn.executemany(_INSERT_SQL, params)
+        except Exception:
+            _conn.execute("ROLLBACK")
+            raise
+        _conn.execute("COMMIT")
     
+def get_latest_podcast_raw():
+    """Fetches the latest podcast entry as (summary, takeaways JSON text), or None."""
+    with _lock:
+        return _conn.execute(_SELECT_LATEST_SQL).fetchone()
+
 def get_latest_podcast_data():
     """Fetches the latest podcast entry from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT summary, takeaways FROM podcast_data ORDER BY id DESC LIMIT 1")
-    result = cursor.fetchone()
-    conn.close()
+    result = get_latest_podcast_raw()
     
     if result:
         summary, takeaways = result
-        return {"summary": summary, "takeaways": json.loads(takeaways)}
+        return {"summary": summary, "takeaways": orjson.loads(takeaways)}
     return None
 
 def get_all_podcasts():
     """Fetches all podcast entries from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, summary, takeaways FROM podcast_data ORDER BY id DESC")
-    results = cursor.fetchall()
-    conn.close()
-    
     podcast_data = []
-    for summary, takeaways in results:
-        podcast_data.append({"summary": summary, "takeaways": json.loads(takeaways)})
+    with _lock:
+        cursor = _conn.execute(_SELECT_ALL_SQL)
+        # Stream in batches rather than materializing the whole table
+        while True:
+            batch = cursor.fetchmany(500)
+            if not batch:
+                break
+            for podcast_id, summary, takeaways in batch:
+                podcast_data.append({"id": podcast_id, "summary": summary, "takeaways": orjson.loads(takeaways)})
     return podcast_data
 
+def get_transcript(podcast_id):
+    """Fetches and decompresses a podcast's transcript by ID, or None if missing."""
+    with _lock:
+        result = _conn.execute(_SELECT_TRANSCRIPT_SQL, (podcast_id,)).fetchone()
+        if not result or result[0] is None:
+            return None
+        return _DCTX.decompress(result[0]).decode()
+
+def get_podcast_by_id_raw(podcast_id):
+    """Fetches a podcast entry by ID as (summary, takeaways JSON text), or None."""
+    with _lock:
+        return _conn.execute(_SELECT_BY_ID_SQL, (podcast_id,)).fetchone()
+
 def get_podcast_by_id(podcast_id):
     """Fetches a podcast entry by ID from the database."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT summary, takeaways FROM podcast_data WHERE id = ?", (podcast_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = get_podcast_by_id_raw(podcast_id)
     
     if result:
         summary, takeaways = result
-        return {"summary": summary, "takeaways": json.loads(takeaways)}
+        return {"summary": summary, "takeaways": orjson.loads(takeaways)}
+    return None
+
+def get_llm_cache(transcript_hash: str, kind: str):
+    """Fetches a cached LLM result for a transcript hash, or None if missing."""
+    with _lock:
+        result = _conn.execute(_SELECT_LLM_CACHE_SQL, (transcript_hash, kind)).fetchone()
+
+    if result:
+        return orjson.loads(result[0])
     return None
 
+def save_llm_cache(transcript_hash: str, kind: str, payload):
+    """Caches an LLM result for a transcript hash."""
+    with _lock:
+        _conn.execute(_INSERT_LLM_CACHE_SQL, (transcript_hash, kind, orjson.dumps(payload).decode()))
+
 # Initialize database
 init_db()
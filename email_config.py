@@ -3,8 +3,8 @@ from email.mime.multipart import MIMEMultipart
 import smtplib
 import db 
 import ssl
+import threading
 from email.mime.text import MIMEText
-from apscheduler.schedulers.background import BackgroundScheduler
 import time
 import os 
 
@@ -24,17 +24,58 @@ RECIPIENT_EMAIL = "mahmud17321@gmail.com"
 # Helper Functions
 # ---------------------------
 
+# Shared SMTP connection, reused across emails (guarded by _smtp_lock)
+_smtp = None
+_smtp_lock = threading.Lock()
+
+def _get_smtp():
+    """Returns the shared SMTP connection, reconnecting if it has dropped."""
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp = None
+
+    context = ssl.create_default_context()
+    server = smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=context)
+    try:
+        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+    except Exception:
+        # Don't leak the socket when authentication fails
+        server.close()
+        raise
+    _smtp = server
+    return _smtp
+
+def close_smtp():
+    """Closes the shared SMTP connection, if open."""
+    global _smtp
+    with _smtp_lock:
+        if _smtp is not None:
+            try:
+                _smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            _smtp = None
+
 def send_email(subject: str, body: str):
     """Sends an email to the user."""
+    global _smtp
     msg = MIMEText(body, "plain")
     msg["Subject"] = subject
     msg["From"] = EMAIL_ADDRESS
     msg["To"] = RECIPIENT_EMAIL
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT, context=context) as server:
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_ADDRESS, RECIPIENT_EMAIL, msg.as_string())
+    with _smtp_lock:
+        try:
+            _get_smtp().sendmail(EMAIL_ADDRESS, RECIPIENT_EMAIL, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped us between the NOOP and the send; reconnect once
+            _smtp = None
+            _get_smtp().sendmail(EMAIL_ADDRESS, RECIPIENT_EMAIL, msg.as_string())
 
 
 
@@ -57,11 +98,6 @@ def send_daily_takeaway():
 
 
 
-# Scheduler setup
-scheduler = BackgroundScheduler()
-scheduler.add_job(send_daily_takeaway, "cron", hour=10, minute=0)
-scheduler.start()
-
 # Keep the script running
 # while True:
 #   time.sleep(5)
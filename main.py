@@ -1,15 +1,28 @@
-import json
+import asyncio
+import functools
+import hashlib
+import aiofiles
+import orjson
 import re
 import whisper
+import numpy as np
+import soundfile as sf
+import soxr
+import torch
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Response
 from pydantic import BaseModel
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient
 from pyngrok import ngrok
-from typing import List
-from email_config import send_email
+from typing import List, Tuple
+from email_config import send_email, send_daily_takeaway, close_smtp
 import db
 import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone, tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # load environment variables
 from dotenv import load_dotenv
@@ -28,22 +41,42 @@ app = FastAPI(
 # Global Configurations
 # ---------------------------
 
-# Load Whisper model for transcription
-whisper_model = whisper.load_model("base")
+# Load Whisper model for transcription (on GPU with FP16 when available)
+WHISPER_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+whisper_model = whisper.load_model("base", device=WHISPER_DEVICE)
+
+# The shared model isn't safe for concurrent decodes (they install KV-cache
+# hooks on the same decoder modules), so transcriptions run one at a time
+_whisper_lock = threading.Lock()
 
 # Hugging Face LLaMA API setup
 MODEL_ID = "meta-llama/Llama-3.2-3B-Instruct"
 HF_API_KEY = os.getenv("HF_API_KEY")
 
-client = InferenceClient(api_key=HF_API_KEY)
+client = AsyncInferenceClient(api_key=HF_API_KEY)
+
+# Transcripts longer than this (~2k tokens) are summarized chunk by chunk first
+TRANSCRIPT_CHUNK_CHARS = 8000
+CHUNK_SUMMARY_CONCURRENCY = 4  # chunk requests in flight at once, to stay under HF rate limits
+CHUNK_SUMMARY_RETRIES = 3
+_chunk_semaphore = asyncio.Semaphore(CHUNK_SUMMARY_CONCURRENCY)
 
 
 # Directory to store uploaded files
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+AUDIO_BLOCK_FRAMES = 1 << 16  # frames decoded per block
+
+# The prompts ask for 3 to 5 takeaways; fewer means the fused response is unusable
+MIN_TAKEAWAYS = 3
 
-# Store quizzes in memory
-quiz_storage = {}
+# Store quizzes in memory, evicting the oldest once QUIZ_STORAGE_CAP is reached
+QUIZ_STORAGE_CAP = 1024
+quiz_storage = OrderedDict()
+
+# Matches trailing commas in arrays or objects: ", }" or ", ]"
+_TRAILING_COMMA_RE = re.compile(r",(\s*[\]}])")
 
 # ---------------------------
 # Helper Functions
@@ -53,28 +86,210 @@ def sanitize_json_output(text: str) -> str:
     Attempt to fix minor JSON formatting issues such as trailing commas
     or missing closing braces.
     """
-    # Remove trailing commas in arrays or objects: ", }" or ", ]"
-    sanitized = re.sub(r",(\s*[\]}])", r"\1", text.strip())
+    sanitized = _TRAILING_COMMA_RE.sub(r"\1", text.strip())
 
     # If it doesn't end with '}', try appending it (very naive approach)
     if not sanitized.endswith("}"):
         sanitized += "}"
     return sanitized
 
+def load_daily_email_timezone() -> tzinfo:
+    """
+    Returns the timezone for the daily email: DAILY_EMAIL_TIMEZONE or TZ if
+    either names a valid zone, else the system local zone, else UTC.
+    """
+    for name in (os.getenv("DAILY_EMAIL_TIMEZONE"), os.getenv("TZ")):
+        if not name:
+            continue
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError, OSError):
+            print(f"Ignoring unknown timezone: {name}")
+
+    try:
+        with open("/etc/localtime", "rb") as f:
+            return ZoneInfo.from_file(f, key="localtime")
+    except (OSError, ValueError):
+        print("System timezone unavailable, using UTC for the daily email.")
+        return timezone.utc
+
+def next_daily_run(hour: int, minute: int, tz: tzinfo) -> datetime:
+    """Returns the next hour:minute in the given timezone, as an aware datetime."""
+    now = datetime.now(tz)
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return target
+
+def seconds_until(target: datetime) -> float:
+    """Returns the real elapsed seconds until an aware datetime, across DST changes."""
+    # Compare in UTC: same-tzinfo subtraction ignores offset changes
+    return (target.astimezone(timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+
+class PartialResult:
+    """
+    Wraps a generator's result built from an incomplete condensed transcript
+    (a chunk failed or was cut), so cache_by_transcript returns it uncached.
+    """
+    def __init__(self, value):
+        self.value = value
+
+def cache_by_transcript(kind: str, version: int):
+    """
+    Caches an async LLM helper's result in the database, keyed by the
+    SHA-256 of the transcript, so repeated transcripts skip inference.
+    The cache kind includes the prompt version and MODEL_ID; bump version
+    whenever a helper's prompt or processing changes. Empty results and
+    PartialResult-wrapped results are not cached.
+    """
+    cache_kind = f"{kind}:v{version}:{MODEL_ID}"
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(transcript: str):
+            transcript_hash = hashlib.sha256(transcript.encode()).hexdigest()
+            cached = await asyncio.to_thread(db.get_llm_cache, transcript_hash, cache_kind)
+            if cached is not None:
+                return cached
+
+            result = await func(transcript)
+            if isinstance(result, PartialResult):
+                return result.value
+            if result:
+                await asyncio.to_thread(db.save_llm_cache, transcript_hash, cache_kind, result)
+            return result
+        return wrapper
+    return decorator
+
+def load_audio(audio_file_path: str) -> np.ndarray:
+    """
+    Decodes audio into a mono float32 array at Whisper's 16 kHz sample rate.
+    Decodes and resamples in-process with soundfile and soxr, falling back
+    to Whisper's ffmpeg loader for formats libsndfile can't read.
+    """
+    try:
+        sample_rate = sf.info(audio_file_path).samplerate  # header only
+        target_rate = whisper.audio.SAMPLE_RATE
+        resampler = None
+        if sample_rate != target_rate:
+            resampler = soxr.ResampleStream(sample_rate, target_rate, 1, dtype="float32")
+
+        # Decode block by block, downmixing and resampling as we go, so only
+        # the 16 kHz mono output is ever held in full
+        pieces = []
+        for block in sf.blocks(audio_file_path, blocksize=AUDIO_BLOCK_FRAMES, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            pieces.append(resampler.resample_chunk(mono) if resampler else mono)
+        if resampler:
+            pieces.append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+    except RuntimeError:
+        return whisper.load_audio(audio_file_path)
+
+    return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+def is_valid_quiz(quiz) -> bool:
+    """Checks that a quiz has a string question, a list of options and a string answer."""
+    return (
+        isinstance(quiz, dict)
+        and isinstance(quiz.get("question"), str)
+        and isinstance(quiz.get("options"), list)
+        and isinstance(quiz.get("correct_answer"), str)
+    )
+
 def transcribe_audio(audio_file_path: str) -> str:
     """Transcribes audio using Whisper."""
-    result = whisper_model.transcribe(audio_file_path)
+    audio = load_audio(audio_file_path)
+    with _whisper_lock:
+        result = whisper_model.transcribe(audio, fp16=WHISPER_DEVICE == "cuda")
     return result["text"]
 
-def generate_summary(transcript: str) -> str:
+def split_transcript(transcript: str, max_chars: int = TRANSCRIPT_CHUNK_CHARS) -> List[str]:
+    """Splits a transcript into chunks of at most max_chars, on word boundaries."""
+    chunks = []
+    current = []
+    length = 0
+    for word in transcript.split():
+        if current and length + len(word) + 1 > max_chars:
+            chunks.append(" ".join(current))
+            current = []
+            length = 0
+        current.append(word)
+        length += len(word) + 1
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+@cache_by_transcript("chunk_summary", version=1)
+async def summarize_chunk(chunk: str) -> str:
+    """Summarizes one chunk of a long podcast transcript using LLaMA."""
+    prompt = (
+        "You are a helpful assistant who summarizes podcasts. "
+        "Summarize the following part of a podcast transcript, keeping its key points, "
+        f"facts and examples:\n\n{chunk}"
+    )
+
+    completion = await client.chat.completions.create(
+        model=MODEL_ID,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=300
+    )
+
+    return completion.choices[0].message.content
+
+async def summarize_chunk_with_retry(chunk: str) -> str:
+    """
+    Summarizes one chunk, with at most CHUNK_SUMMARY_CONCURRENCY in flight,
+    retrying with exponential backoff. Returns "" if every attempt fails.
+    """
+    async with _chunk_semaphore:
+        for attempt in range(CHUNK_SUMMARY_RETRIES):
+            try:
+                return await summarize_chunk(chunk) or ""
+            except Exception as e:
+                print(f"Chunk summary attempt {attempt + 1} failed: {str(e)}")
+                if attempt + 1 < CHUNK_SUMMARY_RETRIES:
+                    await asyncio.sleep(2 ** attempt)
+    return ""
+
+async def condense_transcript(transcript: str) -> Tuple[str, bool]:
+    """
+    Returns (text, complete). The text is the transcript unchanged if it fits
+    in one chunk. Otherwise each chunk is summarized concurrently and the
+    partial summaries joined, repeating until the result fits in one chunk,
+    so the generators always work from a bounded amount of text. Chunks that
+    keep failing are skipped, in which case complete is False.
+    """
+    text = transcript
+    complete = True
+    while len(text) > TRANSCRIPT_CHUNK_CHARS:
+        partial_summaries = await asyncio.gather(
+            *(summarize_chunk_with_retry(chunk) for chunk in split_transcript(text))
+        )
+        if not all(partial_summaries):
+            complete = False
+        partial_summaries = [summary for summary in partial_summaries if summary]
+        if not partial_summaries:
+            raise RuntimeError("Failed to summarize any part of the transcript.")
+
+        condensed = "\n\n".join(partial_summaries)
+        if len(condensed) >= len(text):
+            # The summaries stopped shrinking; cut rather than loop forever
+            return condensed[:TRANSCRIPT_CHUNK_CHARS], False
+        text = condensed
+    return text, complete
+
+@cache_by_transcript("summary", version=3)
+async def generate_summary(transcript: str) -> str:
     """Summarizes a podcast transcript using LLaMA."""
+    transcript, complete = await condense_transcript(transcript)
     prompt = (
         "You are a helpful assistant who summarizes podcasts. "
         f"Summarize the following podcast transcript in a concise and informative manner:\n\n{transcript}"
     )
     
     messages = [{"role": "user", "content": prompt}]
-    completion = client.chat.completions.create(
+    completion = await client.chat.completions.create(
         model=MODEL_ID,
         messages=messages,
         max_tokens=500
@@ -82,13 +297,15 @@ def generate_summary(transcript: str) -> str:
 
     summary = completion.choices[0].message.content
 
-    return summary
+    return summary if complete else PartialResult(summary)
 
-def generate_key_takeaways(transcript: str) -> List[str]:
+@cache_by_transcript("takeaways", version=3)
+async def generate_key_takeaways(transcript: str) -> List[str]:
     """
     Extracts 3 to 5 key takeaways from the podcast transcript.
     The number of takeaways depends on the length of the transcript.
     """
+    transcript, complete = await condense_transcript(transcript)
     prompt = (
         "You are an AI that extracts key insights from podcast transcripts.\n"
         "Analyze the following transcript and provide **3 to 5 key takeaways** in bullet points.\n"
@@ -103,7 +320,7 @@ def generate_key_takeaways(transcript: str) -> List[str]:
     )
 
     messages = [{"role": "user", "content": prompt}]
-    completion = client.chat.completions.create(
+    completion = await client.chat.completions.create(
         model=MODEL_ID,
         messages=messages,
         max_tokens=500
@@ -113,17 +330,20 @@ def generate_key_takeaways(transcript: str) -> List[str]:
     output_text = completion.choices[0].message.content.strip()
     takeaways = [line.strip("- ") for line in output_text.split("\n") if line.startswith("-")]
 
-    return takeaways
+    return takeaways if complete else PartialResult(takeaways)
 
     db.save_podcast_data(transcript, summary, takeaways, quiz)
 
 
-def generate_quiz_question(text: str) -> dict:
+@cache_by_transcript("quiz", version=4)
+async def generate_quiz_question(text: str) -> dict:
     """
     Generates exactly one quiz question from the provided text, returning
     valid JSON with keys: 'question', 'options', 'correct_answer'.
     Enforces exactly 4 options if the model provides more.
     """
+    text, complete = await condense_transcript(text)
+
     # Build a strict prompt
     prompt = (
         "You are a helpful assistant. Create exactly one quiz question from the text below.\n\n"
@@ -145,7 +365,7 @@ def generate_quiz_question(text: str) -> dict:
     )
 
     # Call the LLM
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=MODEL_ID,
         messages=[{"role": "user", "content": prompt}],
         max_tokens=500
@@ -159,19 +379,106 @@ def generate_quiz_question(text: str) -> dict:
 
     # Parse the JSON
     try:
-        quiz = json.loads(sanitized_output)
+        quiz = orjson.loads(sanitized_output)
+
+        # Valid JSON in the wrong shape is a failure too, so it is neither cached nor stored
+        if not is_valid_quiz(quiz):
+            print(f"Unexpected quiz shape: {output_text}")
+            return {}
 
         # If the model returns more than 4 options, truncate to 4
-        if "options" in quiz and len(quiz["options"]) > 4:
+        if len(quiz["options"]) > 4:
             quiz["options"] = quiz["options"][:4]
 
-        return quiz
+        return quiz if complete else PartialResult(quiz)
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         # If still invalid, log the raw text
         print(f"Error decoding response: {output_text}")
         return {}
 
+@cache_by_transcript("insights", version=5)
+async def generate_podcast_insights(transcript: str) -> dict:
+    """
+    Generates the summary, key takeaways and quiz question for a transcript
+    in a single LLM call, so the transcript is only sent and processed once.
+    Returns a dict with keys 'summary', 'takeaways' and 'quiz', or {} if the
+    model's response could not be parsed.
+    """
+    transcript, complete = await condense_transcript(transcript)
+    prompt = (
+        "You are a helpful assistant who analyzes podcast transcripts.\n\n"
+        "From the transcript below, produce:\n"
+        "1. summary: a concise and informative summary of the podcast.\n"
+        "2. takeaways: a list of 3 to 5 clear, concise key takeaways.\n"
+        "3. quiz: exactly one quiz question with EXACTLY 4 answer choices.\n\n"
+        "Requirements:\n"
+        "1. Return ONLY valid JSON.\n"
+        "2. DO NOT include trailing commas or any extra text.\n"
+        "3. DO NOT omit the closing brace.\n\n"
+        f"Transcript:\n{transcript}\n\n"
+        "Your entire response MUST be valid JSON in this exact format:\n"
+        "{\n"
+        "  \"summary\": \"...\",\n"
+        "  \"takeaways\": [\"...\", \"...\", \"...\"],\n"
+        "  \"quiz\": {\n"
+        "    \"question\": \"...\",\n"
+        "    \"options\": [\"...\", \"...\", \"...\", \"...\"],\n"
+        "    \"correct_answer\": \"...\"\n"
+        "  }\n"
+        "}\n"
+    )
+
+    response = await client.chat.completions.create(
+        model=MODEL_ID,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=1200
+    )
+
+    output_text = response.choices[0].message.content.strip()
+    sanitized_output = sanitize_json_output(output_text)
+
+    try:
+        insights = orjson.loads(sanitized_output)
+        if not isinstance(insights, dict):
+            print(f"Unexpected response shape: {output_text}")
+            return {}
+
+        summary = insights.get("summary")
+        takeaways = insights.get("takeaways")
+        quiz = insights.get("quiz")
+
+        # Valid JSON with missing or misnamed keys counts as a failure too
+        if not (isinstance(summary, str) and summary.strip()
+                and isinstance(takeaways, list) and len(takeaways) >= MIN_TAKEAWAYS
+                and all(isinstance(takeaway, str) and takeaway.strip() for takeaway in takeaways)
+                and is_valid_quiz(quiz)):
+            print(f"Unexpected response shape: {output_text}")
+            return {}
+
+        # If the model returns more than 4 options, truncate to 4
+        if len(quiz["options"]) > 4:
+            quiz["options"] = quiz["options"][:4]
+
+        insights = {
+            "summary": summary,
+            "takeaways": takeaways,
+            "quiz": quiz
+        }
+        return insights if complete else PartialResult(insights)
+
+    except orjson.JSONDecodeError:
+        print(f"Error decoding response: {output_text}")
+        return {}
+
+def podcast_json_response(summary: str, takeaways: str) -> Response:
+    """
+    Builds a {"podcast": {...}} JSON response, splicing in the takeaways
+    JSON exactly as stored instead of parsing and re-encoding it.
+    """
+    body = b'{"podcast":{"summary":' + orjson.dumps(summary) + b',"takeaways":' + takeaways.encode() + b'}}'
+    return Response(content=body, media_type="application/json")
+
 def send_detail(transcript: str, summary: str):
     """Sends a daily email with one key takeaway from the latest podcast."""
     
@@ -206,18 +513,33 @@ async def upload_audio(file: UploadFile = File(...)):
     file_path = os.path.join(UPLOAD_DIR, file.filename)
 
     try:
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-
-        transcript = transcribe_audio(file_path)
-        summary = generate_summary(transcript)
-        takeaways = generate_key_takeaways(transcript)
-        quiz = generate_quiz_question(transcript)
-
-        send_detail("Podcast summary", summary)
+        # Stream the upload to disk in 1 MiB chunks instead of buffering it all
+        async with aiofiles.open(file_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await f.write(chunk)
+
+        # Whisper, SMTP and SQLite calls block, so run them off the event loop
+        transcript = await asyncio.to_thread(transcribe_audio, file_path)
+        insights = await generate_podcast_insights(transcript)
+        if insights:
+            summary = insights["summary"]
+            takeaways = insights["takeaways"]
+            quiz = insights["quiz"]
+        else:
+            # Fall back to the individual generators, issued concurrently
+            summary, takeaways, quiz = await asyncio.gather(
+                generate_summary(transcript),
+                generate_key_takeaways(transcript),
+                generate_quiz_question(transcript)
+            )
+
+        await asyncio.to_thread(send_detail, "Podcast summary", summary)
 
         # Save to database
-        db.save_podcast_data(transcript, summary, takeaways, quiz)
+        await asyncio.to_thread(db.save_podcast_data, transcript, summary, takeaways, quiz)
 
         return {
             "message": "Podcast processed and saved successfully!",
@@ -230,14 +552,14 @@ async def upload_audio(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
     finally:
         if os.path.exists(file_path):
-            os.remove(file_path)
+            await asyncio.to_thread(os.remove, file_path)
 
 
 @app.post("/summarize", summary="Generate Podcast Summary", tags=["Summarization"])
 async def summarize_podcast(data: PodcastTranscript):
     """API endpoint to generate a summary from a podcast transcript."""
     try:
-        summary = generate_summary(data.transcript)
+        summary = await generate_summary(data.transcript)
         return {"summary": summary}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Summary generation failed: {str(e)}")
@@ -248,7 +570,7 @@ async def summarize_podcast(data: PodcastTranscript):
 async def get_key_takeaways(data: PodcastTranscript):
     """API endpoint to generate key takeaways from a podcast transcript."""
     try:
-        takeaways = generate_key_takeaways(data.transcript)
+        takeaways = await generate_key_takeaways(data.transcript)
         if not takeaways:
             raise HTTPException(status_code=500, detail="Failed to extract key takeaways.")
         
@@ -261,12 +583,15 @@ async def get_key_takeaways(data: PodcastTranscript):
 async def api_quiz(data: QuizRequest):
     """Generates a single quiz question from the provided transcript."""
     try:
-        quiz = generate_quiz_question(data.transcript)
+        quiz = await generate_quiz_question(data.transcript)
         if not quiz:
             raise HTTPException(status_code=500, detail="Failed to generate quiz question.")
 
-        quiz_id = str(len(quiz_storage) + 1)  # Assign a unique ID
-        quiz_storage[quiz_id] = quiz  # Store the quiz
+        quiz_id = uuid.uuid4().hex  # Assign a unique ID
+        # Store the quiz with its answer normalized once, for cheap validation
+        quiz_storage[quiz_id] = {**quiz, "_correct_norm": quiz["correct_answer"].strip().lower()}
+        if len(quiz_storage) > QUIZ_STORAGE_CAP:
+            quiz_storage.popitem(last=False)
 
         return {"quiz_id": quiz_id, "quiz": quiz}
 
@@ -281,7 +606,7 @@ async def submit_quiz_answer(data: QuizAnswer):
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found.")
 
-    is_correct = data.answer.strip().lower() == quiz["correct_answer"].strip().lower()
+    is_correct = data.answer.strip().lower() == quiz["_correct_norm"]
 
     return {"quiz_id": data.quiz_id, "correct": is_correct, "correct_answer": quiz["correct_answer"]}
 
@@ -291,10 +616,10 @@ async def submit_quiz_answer(data: QuizAnswer):
 async def get_latest_podcast():
     """API endpoint to get the latest podcast from the database."""
     try:
-        podcast = db.get_latest_podcast_data()
+        podcast = await asyncio.to_thread(db.get_latest_podcast_raw)
         if not podcast:
             raise HTTPException(status_code=404, detail="Podcast not found.")
-        return {"podcast": podcast}
+        return podcast_json_response(*podcast)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
     
@@ -302,19 +627,19 @@ async def get_latest_podcast():
 async def get_podcast_by_id(podcast_id: int):
     """API endpoint to get a podcast by ID from the database."""
     try:
-        podcast = db.get_podcast_by_id(podcast_id)
+        podcast = await asyncio.to_thread(db.get_podcast_by_id_raw, podcast_id)
         if not podcast:
             raise HTTPException(status_code=404, detail="Podcast not found.")
-        return {"podcast": podcast}
+        return podcast_json_response(*podcast)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
     
 @app.post("/send-email", summary="Send Email", tags=["Send email"])
 async def send_email_api(data: PodcastTranscript):
     """API endpoint to send an email with the provided transcript."""
-    summary = generate_summary(data.transcript)
+    summary = await generate_summary(data.transcript)
     try:
-        send_detail(data.transcript, summary)
+        await asyncio.to_thread(send_detail, data.transcript, summary)
         return {"message": "Email sent successfully!"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
@@ -327,6 +652,38 @@ def read_root():
     return {"message": "Podcast Transcription API is running!", "version": "1.0.1"}
 
 
+@app.on_event("startup")
+async def schedule_daily_takeaway():
+    """Sends the daily takeaway email at 10:00 every day."""
+    async def daily_loop():
+        target = next_daily_run(10, 0, load_daily_email_timezone())
+        while True:
+            # asyncio.sleep runs on the monotonic clock and can wake early
+            # by the wall clock, so keep sleeping until the target has passed
+            while (remaining := seconds_until(target)) > 0:
+                await asyncio.sleep(remaining)
+
+            try:
+                await asyncio.to_thread(send_daily_takeaway)
+            except Exception as e:
+                print(f"Daily takeaway email failed: {str(e)}")
+
+            # Advance by calendar day (wall-clock 10:00), skipping any missed runs
+            while seconds_until(target) <= 0:
+                target += timedelta(days=1)
+
+    # Keep a reference so the task isn't garbage collected
+    app.state.daily_takeaway_task = asyncio.create_task(daily_loop())
+
+
+@app.on_event("shutdown")
+def close_connections():
+    """Stops the daily email task and closes shared connections on shutdown."""
+    app.state.daily_takeaway_task.cancel()
+    db.close_db()
+    close_smtp()
+
+
 
 
 